@@ -1,7 +1,14 @@
+# Install uvloop before Streamlit/Tornado create their event loop
+import asyncio
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass  # uvloop is not available on Windows
+
 from http.server import HTTPServer, SimpleHTTPRequestHandler
-import subprocess
-import sys
 import os
+from streamlit.web import bootstrap
 
 def handler(*args):
     """Start Streamlit server"""
@@ -9,16 +16,16 @@ def handler(*args):
         # Change to app directory
         os.chdir(os.path.dirname(os.path.abspath(__file__)))
         
-        # Start streamlit
-        subprocess.run([
-            sys.executable, "-m", "streamlit", "run", 
-            "streamlit_app.py", 
-            "--server.port=8080",
-            "--server.address=0.0.0.0",
-            "--server.headless=true",
-            "--server.fileWatcherType=none",
-            "--browser.gatherUsageStats=false"
-        ])
+        # Start streamlit in this process instead of spawning a new interpreter
+        flag_options = {
+            "server_port": 8080,
+            "server_address": "0.0.0.0",
+            "server_headless": True,
+            "server_fileWatcherType": "none",
+            "browser_gatherUsageStats": False
+        }
+        bootstrap.load_config_options(flag_options=flag_options)
+        bootstrap.run("streamlit_app.py", False, [], flag_options)
     except Exception as e:
         print(f"Error starting Streamlit: {e}")
 
@@ -4,11 +4,17 @@ This version provides a better UX with clearer instructions and state management
 """
 
 import streamlit as st
+import copy
+import functools
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.http import build_http
 from google.auth.transport.requests import Request
 
 # Google Drive API scopes
@@ -19,37 +25,105 @@ SCOPES = [
     'openid'
 ]
 
+# Worker threads for blocking OAuth token requests
+_auth_executor = ThreadPoolExecutor(max_workers=2)
+
+CREDENTIALS_PATH = os.path.join(os.path.dirname(__file__), 'credentials.json')
+
+@functools.lru_cache(maxsize=1)
+def _load_config_raw():
+    """Read credentials.json once per process"""
+    with open(CREDENTIALS_PATH, 'r') as f:
+        return json.load(f)
+
+def load_client_config():
+    """Load the OAuth client configuration normalized for the installed app flow"""
+    config = copy.deepcopy(_load_config_raw())
+    
+    # Always use installed app flow for desktop/streamlit apps
+    if 'installed' in config:
+        # Keep the installed configuration but ensure it has the right redirect URI
+        config['installed']['redirect_uris'] = ['urn:ietf:wg:oauth:2.0:oob']
+        return config
+    elif 'web' in config:
+        # Convert web config to installed for better compatibility
+        web_config = config['web']
+        return {
+            "installed": {
+                "client_id": web_config['client_id'],
+                "client_secret": web_config['client_secret'],
+                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+                "token_uri": "https://oauth2.googleapis.com/token",
+                "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
+                "redirect_uris": ["urn:ietf:wg:oauth:2.0:oob"]
+            }
+        }
+    return None
+
+# Where credentials are kept between sessions when IMOS_PERSIST_CREDENTIALS is set
+PERSISTED_CREDENTIALS_PATH = os.path.expanduser('~/.imos_creds.json')
+
+def _persist_credentials_enabled():
+    return os.getenv('IMOS_PERSIST_CREDENTIALS', '').lower() in ('1', 'true', 'yes')
+
+def save_persisted_credentials(credentials):
+    """Save credentials (including the refresh token) to disk, readable by the owner only"""
+    if not _persist_credentials_enabled():
+        return
+    
+    try:
+        fd = os.open(PERSISTED_CREDENTIALS_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(credentials.to_json())
+    except OSError as e:
+        print(f"Warning: Could not save credentials: {e}")
+
+def load_persisted_credentials():
+    """Load credentials saved by an earlier session, if any"""
+    if not _persist_credentials_enabled() or not os.path.exists(PERSISTED_CREDENTIALS_PATH):
+        return None
+    
+    try:
+        return Credentials.from_authorized_user_file(PERSISTED_CREDENTIALS_PATH, SCOPES)
+    except Exception:
+        return None
+
+def clear_persisted_credentials():
+    """Remove credentials saved to disk"""
+    try:
+        os.remove(PERSISTED_CREDENTIALS_PATH)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Warning: Could not remove saved credentials: {e}")
+
+def build_drive_service(credentials):
+    """Build a Drive v3 service on the client library's default transport"""
+    # build_http() sets the client's 60s timeout and its redirect handling; the client
+    # already asks for gzip on API calls and leaves ranged media downloads uncompressed
+    http = AuthorizedHttp(credentials, http=build_http())
+    # Use the discovery document bundled with the client instead of fetching it
+    return build('drive', 'v3', http=http, cache_discovery=False, static_discovery=True)
+
+def get_session_drive_service(credentials):
+    """Get the Drive service for these credentials, built once per session"""
+    service = st.session_state.get('drive_service')
+    if service is None or service._http.credentials is not credentials:
+        service = build_drive_service(credentials)
+        st.session_state.drive_service = service
+    return service
+
 class GoogleDriveAuth:
     def __init__(self):
-        self.credentials_path = os.path.join(os.path.dirname(__file__), 'credentials.json')
+        self.credentials_path = CREDENTIALS_PATH
     
     def load_credentials_config(self):
         """Load Google OAuth credentials configuration"""
         try:
-            with open(self.credentials_path, 'r') as f:
-                config = json.load(f)
-            
-            # Always use installed app flow for desktop/streamlit apps
-            if 'installed' in config:
-                # Keep the installed configuration but ensure it has the right redirect URI
-                config['installed']['redirect_uris'] = ['urn:ietf:wg:oauth:2.0:oob']
-                return config
-            elif 'web' in config:
-                # Convert web config to installed for better compatibility
-                web_config = config['web']
-                return {
-                    "installed": {
-                        "client_id": web_config['client_id'],
-                        "client_secret": web_config['client_secret'],
-                        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                        "token_uri": "https://oauth2.googleapis.com/token",
-                        "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-                        "redirect_uris": ["urn:ietf:wg:oauth:2.0:oob"]
-                    }
-                }
-            else:
+            config = load_client_config()
+            if not config:
                 st.error("Invalid credentials format. Please check your credentials.json file.")
-                return None
+            return config
                 
         except Exception as e:
             st.error(f"Error loading credentials: {e}")
@@ -58,13 +132,18 @@ class GoogleDriveAuth:
     def is_authenticated(self):
         """Check if user is currently authenticated"""
         if 'google_credentials' not in st.session_state:
-            return False
+            # Restore credentials saved by an earlier session, if enabled
+            credentials = load_persisted_credentials()
+            if credentials is None:
+                return False
+            st.session_state.google_credentials = credentials
         
         credentials = st.session_state.google_credentials
         if not credentials.valid:
             if credentials.refresh_token:
                 try:
                     credentials.refresh(Request())
+                    save_persisted_credentials(credentials)
                     return True
                 except:
                     return False
@@ -99,28 +178,41 @@ class GoogleDriveAuth:
             st.error(f"Error generating auth URL: {e}")
             return None
     
-    def exchange_code(self, auth_code):
-        """Exchange authorization code for access token"""
-        try:
-            if 'oauth_flow' not in st.session_state:
-                # Create a new flow if needed
-                config = self.load_credentials_config()
-                if not config:
-                    return False, "Configuration error"
-                
-                flow = Flow.from_client_config(
-                    config,
-                    scopes=SCOPES
-                )
-                flow.redirect_uri = 'urn:ietf:wg:oauth:2.0:oob'
-            else:
-                flow = st.session_state.oauth_flow
+    def start_code_exchange(self, auth_code):
+        """Start exchanging the authorization code for an access token"""
+        if 'oauth_flow' not in st.session_state:
+            # Create a new flow if needed
+            config = self.load_credentials_config()
+            if not config:
+                return False
             
-            # Exchange code for token
-            flow.fetch_token(code=auth_code.strip())
+            flow = Flow.from_client_config(
+                config,
+                scopes=SCOPES
+            )
+            flow.redirect_uri = 'urn:ietf:wg:oauth:2.0:oob'
+            st.session_state.oauth_flow = flow
+        
+        # Run the token request on a worker thread so the script thread stays free
+        flow = st.session_state.oauth_flow
+        st.session_state.auth_future = _auth_executor.submit(flow.fetch_token, code=auth_code.strip())
+        return True
+    
+    def finish_code_exchange(self):
+        """Collect the code exchange result, or None while it is still running"""
+        future = st.session_state.get('auth_future')
+        if future is None:
+            return False, "Authentication failed: no authorization in progress"
+        if not future.done():
+            return None
+        
+        del st.session_state.auth_future
+        try:
+            future.result()
             
             # Store credentials
-            st.session_state.google_credentials = flow.credentials
+            st.session_state.google_credentials = st.session_state.oauth_flow.credentials
+            save_persisted_credentials(st.session_state.google_credentials)
             
             # Clean up
             if 'oauth_flow' in st.session_state:
@@ -139,14 +231,15 @@ class GoogleDriveAuth:
     
     def sign_out(self):
         """Sign out and clear all authentication data"""
-        keys_to_remove = ['google_credentials', 'oauth_flow', 'auth_step', 'auth_url']
+        clear_persisted_credentials()
+        keys_to_remove = ['google_credentials', 'oauth_flow', 'auth_step', 'auth_url', 'auth_future', 'auth_error', 'folder_name_map', 'drive_service', 'authenticated']
         for key in keys_to_remove:
             if key in st.session_state:
                 del st.session_state[key]
     
     def reset_auth_flow(self):
         """Reset the authentication flow"""
-        keys_to_remove = ['oauth_flow', 'auth_step', 'auth_url']
+        keys_to_remove = ['oauth_flow', 'auth_step', 'auth_url', 'auth_future', 'auth_error']
         for key in keys_to_remove:
             if key in st.session_state:
                 del st.session_state[key]
@@ -158,7 +251,7 @@ class GoogleDriveAuth:
             return None
         
         try:
-            return build('drive', 'v3', credentials=st.session_state.google_credentials)
+            return get_session_drive_service(st.session_state.google_credentials)
         except Exception as e:
             st.error(f"Error creating Drive service: {e}")
             return None
@@ -218,6 +311,11 @@ class GoogleDriveAuth:
                 </div>
                 """, unsafe_allow_html=True)
                 
+                if 'auth_error' in st.session_state:
+                    st.error(st.session_state.auth_error)
+                    st.info("💡 Make sure you copied the entire authorization code. If the problem persists, click 'Start Over'.")
+                    del st.session_state.auth_error
+                
                 st.markdown("**Instructions:**")
                 st.markdown("1. Click the authorization link above (opens in new tab)")
                 st.markdown("2. Sign in to your Google account")
@@ -246,24 +344,40 @@ class GoogleDriveAuth:
                         st.rerun()
                     
                     if submit and auth_code:
-                        with st.spinner("Verifying authorization..."):
-                            success, message = self.exchange_code(auth_code)
-                            
-                            if success:
-                                st.success(message)
-                                st.session_state.auth_step = 1  # Reset for next time
-                                if 'auth_url' in st.session_state:
-                                    del st.session_state.auth_url
-                                st.balloons()
-                                st.rerun()
-                            else:
-                                st.error(message)
-                                if "scope mismatch" in message.lower() or "scope has changed" in message.lower():
-                                    st.warning("⚠️ Scope mismatch detected. Restarting authentication process...")
-                                    self.reset_auth_flow()
-                                    st.rerun()
-                                else:
-                                    st.info("💡 Make sure you copied the entire authorization code. If the problem persists, click 'Start Over'.")
+                        if self.start_code_exchange(auth_code):
+                            st.session_state.auth_step = 3
+                            st.rerun()
+                        else:
+                            st.error("Configuration error")
+        
+        elif st.session_state.auth_step == 3:
+            # Step 3: Wait for the background token exchange
+            st.markdown("### Step 3: Verifying Authorization")
+            
+            result = self.finish_code_exchange()
+            if result is None:
+                with st.spinner("Verifying authorization..."):
+                    time.sleep(0.5)
+                st.rerun()
+            
+            success, message = result
+            if success:
+                st.success(message)
+                st.session_state.auth_step = 1  # Reset for next time
+                if 'auth_url' in st.session_state:
+                    del st.session_state.auth_url
+                st.balloons()
+                st.rerun()
+            else:
+                st.error(message)
+                if "scope mismatch" in message.lower() or "scope has changed" in message.lower():
+                    st.warning("⚠️ Scope mismatch detected. Restarting authentication process...")
+                    self.reset_auth_flow()
+                else:
+                    # Show the error on the code entry step
+                    st.session_state.auth_error = message
+                    st.session_state.auth_step = 2
+                st.rerun()
         
         return False
 
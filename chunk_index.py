@@ -0,0 +1,110 @@
+"""
+Persisted usearch HNSW index over the chunk embeddings in memoryos.db
+Kept free of Streamlit imports: the index is loaded or built on a background thread
+"""
+
+import os
+import sqlite3
+import threading
+import numpy as np
+from usearch.index import Index
+
+class ChunkIndex:
+    """HNSW index over the int8 chunk embeddings of one dimension, saved beside the database"""
+
+    def __init__(self, db_path, ndim):
+        self.db_path = db_path
+        self.ndim = ndim
+        self.path = f"{os.path.splitext(db_path)[0]}.{ndim}.usearch"
+        self.lock = threading.Lock()
+        self.index = None
+        # Updates made while the index is loading, replayed once it is ready
+        self.pending = None
+
+    @property
+    def ready(self):
+        return self.index is not None
+
+    def ensure_loaded(self):
+        """Start loading (or building) the index in the background, if not already started"""
+        with self.lock:
+            if self.index is not None or self.pending is not None:
+                return
+            self.pending = []
+        threading.Thread(target=self._load, name='chunk-index', daemon=True).start()
+
+    def _new_index(self):
+        return Index(ndim=self.ndim, metric='cos', dtype='i8', connectivity=16, expansion_add=64)
+
+    def _load(self):
+        """Load the saved index, rebuilding it when it does not match the database"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                count, max_id = conn.execute(
+                    'SELECT COUNT(*), MAX(id) FROM pdf_chunks WHERE length(embedding) = ?', (self.ndim,)
+                ).fetchone()
+
+                # Chunk ids only grow, so a count and newest id that match mean the saved
+                # index has every chunk (it misses updates from a run that stopped early)
+                index = Index.restore(self.path) if os.path.exists(self.path) else None
+                rebuilt = index is None or index.ndim != self.ndim or len(index) != count or (count and max_id not in index)
+                if rebuilt:
+                    index = self._new_index()
+                    rows = conn.execute(
+                        'SELECT id, embedding FROM pdf_chunks WHERE length(embedding) = ? ORDER BY id', (self.ndim,)
+                    ).fetchall()
+                    if rows:
+                        self._add(index, rows)
+            finally:
+                conn.close()
+
+            with self.lock:
+                for removed_ids, added_rows in self.pending:
+                    self._apply(index, removed_ids, added_rows)
+                if rebuilt or self.pending:
+                    self._save(index)
+                self.index = index
+                self.pending = None
+        except Exception as e:
+            print(f"Warning: Could not load the chunk index: {e}")
+            with self.lock:
+                # Let the next search try again
+                self.pending = None
+
+    def _add(self, index, rows):
+        """Add (chunk id, int8 embedding bytes) rows to an index"""
+        keys = np.array([row[0] for row in rows], dtype=np.uint64)
+        # usearch quantizes the float32 unit vectors back to int8 for storage
+        vectors = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.int8).reshape(len(rows), self.ndim)
+        index.add(keys, vectors.astype(np.float32) / 127)
+
+    def _apply(self, index, removed_ids, added_rows):
+        """Remove replaced chunks and add new ones (safe to repeat)"""
+        added_rows = [row for row in added_rows if len(row[1]) == self.ndim]
+        keys = list(removed_ids) + [row[0] for row in added_rows]
+        if keys:
+            index.remove(np.array(keys, dtype=np.uint64))
+        if added_rows:
+            self._add(index, added_rows)
+
+    def _save(self, index):
+        # Write to a temporary file so a crash never leaves a truncated index behind
+        tmp_path = f"{self.path}.tmp"
+        index.save(tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def update(self, removed_ids, added_rows):
+        """Apply committed chunk changes: drop removed_ids, add (chunk id, embedding) rows"""
+        with self.lock:
+            if self.index is not None:
+                self._apply(self.index, removed_ids, added_rows)
+                self._save(self.index)
+            elif self.pending is not None:
+                self.pending.append((removed_ids, added_rows))
+            # Otherwise the index is not in use; the next load checks the saved file
+
+    def search(self, vector, count):
+        """Nearest chunks to a float32 unit vector, as usearch Matches"""
+        with self.lock:
+            return self.index.search(vector, count)
@@ -1,288 +1,167 @@
 import streamlit as st
 from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
-import io
-import PyPDF2
+import asyncio
+import httpx
 import json
 import os
-import base64
-import pickle
+import random
+import tempfile
+import time
 from datetime import datetime
-from urllib.parse import urlencode
 
-# Google Drive API scopes
-SCOPES = [
-    'https://www.googleapis.com/auth/drive.readonly',
-    'https://www.googleapis.com/auth/userinfo.email',
-    'https://www.googleapis.com/auth/userinfo.profile',
-    'openid'
-]
+# Extraction runs in worker processes that must not import Streamlit
+from pdf_extract import extract_pdf_file, extract_pdf_text
 
-def get_credentials_path():
-    """Get the path to credentials.json"""
-    return os.path.join(os.path.dirname(__file__), 'credentials.json')
+# Authentication lives in auth_improved; re-exported here for existing imports
+from auth_improved import (
+    SCOPES,
+    authenticate_drive,
+    init_drive_service,
+    is_authenticated,
+    sign_out
+)
 
-def get_auth_url():
-    """Generate Google OAuth URL"""
-    try:
-        creds_path = get_credentials_path()
-        if not os.path.exists(creds_path):
-            return None, "credentials.json not found"
-        
-        # Load client configuration
-        with open(creds_path, 'r') as f:
-            client_config = json.load(f)
-        
-        # Use the installed app configuration but modify for web
-        if 'installed' in client_config:
-            # Convert installed app config to web app config
-            config = {
-                "web": {
-                    "client_id": client_config['installed']['client_id'],
-                    "client_secret": client_config['installed']['client_secret'],
-                    "auth_uri": client_config['installed']['auth_uri'],
-                    "token_uri": client_config['installed']['token_uri'],
-                    "redirect_uris": ["urn:ietf:wg:oauth:2.0:oob"]
-                }
-            }
-        else:
-            config = client_config
-        
-        # Create flow for out-of-band (manual code entry)
-        flow = Flow.from_client_config(
-            config,
-            scopes=SCOPES,
-            redirect_uri='urn:ietf:wg:oauth:2.0:oob'
-        )
-        
-        # Generate auth URL
-        auth_url, _ = flow.authorization_url(
-            access_type='offline',
-            include_granted_scopes='true',
-            prompt='consent'
-        )
-        
-        return auth_url, None
-        
-    except Exception as e:
-        return None, str(e)
+DRIVE_FILES_URL = 'https://www.googleapis.com/drive/v3/files'
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
-def exchange_code_for_token(auth_code):
-    """Exchange authorization code for access token"""
-    try:
-        creds_path = get_credentials_path()
-        
-        # Load client configuration
-        with open(creds_path, 'r') as f:
-            client_config = json.load(f)
-        
-        # Convert to web config if needed
-        if 'installed' in client_config:
-            config = {
-                "web": {
-                    "client_id": client_config['installed']['client_id'],
-                    "client_secret": client_config['installed']['client_secret'],
-                    "auth_uri": client_config['installed']['auth_uri'],
-                    "token_uri": client_config['installed']['token_uri'],
-                    "redirect_uris": ["urn:ietf:wg:oauth:2.0:oob"]
-                }
-            }
-        else:
-            config = client_config
-        
-        # Create flow
-        flow = Flow.from_client_config(
-            config,
-            scopes=SCOPES,
-            redirect_uri='urn:ietf:wg:oauth:2.0:oob'
-        )
-        
-        # Exchange code for token
-        flow.fetch_token(code=auth_code.strip())
-        
-        # Store credentials
-        st.session_state.google_credentials = flow.credentials
-        
-        # Also store in a more persistent way
-        creds_dict = {
-            'token': flow.credentials.token,
-            'refresh_token': flow.credentials.refresh_token,
-            'token_uri': flow.credentials.token_uri,
-            'client_id': flow.credentials.client_id,
-            'client_secret': flow.credentials.client_secret,
-            'scopes': flow.credentials.scopes
-        }
-        st.session_state.google_creds_dict = creds_dict
-        
-        return True, "Authentication successful!"
-        
-    except Exception as e:
-        return False, f"Authentication failed: {str(e)}"
+# Range size for MediaIoBaseDownload (its 100KB default means one request per 100KB)
+MEDIA_CHUNK_SIZE = 10 * 1024 * 1024
 
-def load_stored_credentials():
-    """Load stored credentials if available"""
-    try:
-        if 'google_creds_dict' in st.session_state:
-            creds_dict = st.session_state.google_creds_dict
-            
-            # Recreate credentials object
-            credentials = Credentials(
-                token=creds_dict.get('token'),
-                refresh_token=creds_dict.get('refresh_token'),
-                token_uri=creds_dict.get('token_uri'),
-                client_id=creds_dict.get('client_id'),
-                client_secret=creds_dict.get('client_secret'),
-                scopes=creds_dict.get('scopes')
-            )
-            
-            # Check if credentials are valid and refresh if needed
-            if credentials.valid:
-                st.session_state.google_credentials = credentials
-                return True
-            elif credentials.refresh_token:
-                try:
-                    credentials.refresh(Request())
-                    st.session_state.google_credentials = credentials
-                    # Update stored dict
-                    st.session_state.google_creds_dict['token'] = credentials.token
-                    return True
-                except:
-                    # Refresh failed, need to re-authenticate
-                    return False
-        
+# Maximum number of calls Drive accepts in a single batch request
+BATCH_SIZE = 100
+
+# Drive responses worth retrying with exponential backoff
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RETRY_MAX_ATTEMPTS = 5
+
+# Drive v3 mostly reports rate limiting as a 403 with one of these reasons, not a 429
+RATE_LIMIT_REASONS = ('userRateLimitExceeded', 'rateLimitExceeded')
+
+def _is_retryable(status, content=b''):
+    """Whether a Drive error response is a rate limit or server error worth retrying"""
+    if status in RETRYABLE_STATUSES:
+        return True
+    if status != 403:
         return False
-        
-    except Exception:
+    try:
+        errors = json.loads(content).get('error', {}).get('errors', [])
+        return any(error.get('reason') in RATE_LIMIT_REASONS for error in errors)
+    except (TypeError, ValueError, AttributeError):
         return False
 
-def authenticate_drive():
-    """Main authentication function with improved UX"""
-    # Try to load existing credentials first
-    if load_stored_credentials():
-        return True
-    
-    # Show authentication UI
-    st.subheader("🔐 Google Drive Authentication")
-    st.info("To access your PDFs, we need permission to read your Google Drive files.")
-    
-    # Step 1: Generate auth URL
-    col1, col2 = st.columns([2, 1])
+def _retry_delay(attempt, retry_after=None):
+    """Seconds to wait before the next attempt, honoring a Retry-After header"""
+    if retry_after and retry_after.isdigit():
+        return int(retry_after)
+    return min(2 ** attempt, 32) + random.random()
+
+def retry(fn, max_attempts=RETRY_MAX_ATTEMPTS):
+    """Call fn, backing off exponentially on Drive rate limits and server errors"""
+    for attempt in range(max_attempts):
+        try:
+            return fn()
+        except HttpError as e:
+            if not _is_retryable(e.resp.status, e.content) or attempt == max_attempts - 1:
+                raise
+            time.sleep(_retry_delay(attempt, e.resp.get('retry-after')))
+
+def get_folder_names(service, folder_ids):
+    """Resolve folder ids to names using batched Drive requests"""
+    parent_map = {}
     
-    with col1:
-        if st.button("🚀 Start Authentication", type="primary", use_container_width=True):
-            auth_url, error = get_auth_url()
-            
-            if auth_url:
-                st.session_state.auth_url = auth_url
-                st.session_state.show_auth_step = True
+    def on_response(folder_id):
+        def callback(request_id, response, exception):
+            if exception is None:
+                parent_map[folder_id] = response.get('name', 'Drive')
             else:
-                st.error(f"Failed to generate auth URL: {error}")
+                parent_map[folder_id] = 'Drive'
+        return callback
     
-    # Show authentication steps if URL is generated
-    if st.session_state.get('show_auth_step', False) and st.session_state.get('auth_url'):
-        st.markdown("---")
-        
-        # Step 1: Auth URL
-        st.markdown("**Step 1:** Click the link below to authenticate:")
-        auth_url = st.session_state.auth_url
-        
-        # Create a more prominent link
-        st.markdown(f"""
-        <div style="padding: 10px; background-color: #e1f5fe; border-radius: 5px; margin: 10px 0;">
-            <a href="{auth_url}" target="_blank" style="color: #0277bd; font-weight: bold; text-decoration: none;">
-                🔗 Open Google Authentication Page
-            </a>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        # Step 2: Code input
-        st.markdown("**Step 2:** Copy the authorization code and paste it here:")
-        
-        with st.form("auth_form", clear_on_submit=False):
-            auth_code = st.text_input(
-                "Authorization Code:",
-                placeholder="Paste the code you received from Google here...",
-                type="password"
+    folder_ids = list(folder_ids)
+    for start in range(0, len(folder_ids), BATCH_SIZE):
+        batch = service.new_batch_http_request()
+        for folder_id in folder_ids[start:start + BATCH_SIZE]:
+            batch.add(
+                service.files().get(fileId=folder_id, fields='name'),
+                callback=on_response(folder_id)
             )
-            submit_button = st.form_submit_button("🔑 Complete Authentication")
-            
-            if submit_button and auth_code:
-                with st.spinner("Verifying authorization code..."):
-                    success, message = exchange_code_for_token(auth_code)
-                    
-                    if success:
-                        st.success(message)
-                        # Clear the auth step
-                        st.session_state.show_auth_step = False
-                        st.session_state.auth_url = None
-                        # Rerun to refresh the page
-                        st.rerun()
-                    else:
-                        st.error(message)
-        
-        # Add helpful instructions
-        st.markdown("""
-        **Instructions:**
-        1. Click the authentication link above (opens in new tab)
-        2. Choose your Google account and grant permissions
-        3. Copy the authorization code shown on the screen
-        4. Paste the code in the input box above and click "Complete Authentication"
-        """)
+        try:
+            retry(batch.execute)
+        except Exception:
+            continue
     
-    return 'google_credentials' in st.session_state
+    return parent_map
 
-def init_drive_service():
-    """Initialize Google Drive service"""
-    try:
-        if 'google_credentials' not in st.session_state:
-            return None
-        
-        service = build('drive', 'v3', credentials=st.session_state.google_credentials)
-        return service
-        
-    except Exception as e:
-        st.error(f"Failed to initialize Drive service: {str(e)}")
-        return None
-
-def is_authenticated():
-    """Check if user is authenticated"""
-    return 'google_credentials' in st.session_state
-
-def sign_out():
-    """Sign out and clear credentials"""
-    keys_to_remove = ['google_credentials', 'google_creds_dict', 'auth_url', 'show_auth_step']
-    for key in keys_to_remove:
-        if key in st.session_state:
-            del st.session_state[key]
+def get_folder_name_map(service):
+    """Get a folder id to name map, fetched once per session"""
+    folder_map = st.session_state.get('folder_name_map')
+    if folder_map is not None:
+        return folder_map
+    
+    folder_map = {}
+    page_token = None
+    while True:
+        response = retry(service.files().list(
+            q="mimeType='application/vnd.google-apps.folder' and trashed=false",
+            pageSize=1000,
+            pageToken=page_token,
+            fields="nextPageToken, files(id, name)"
+        ).execute)
+        
+        for folder in response.get('files', []):
+            folder_map[folder['id']] = folder['name']
+        
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+    
+    st.session_state.folder_name_map = folder_map
+    return folder_map
 
-def list_all_pdfs(service, max_results=1000):
-    """List all PDF files from Google Drive"""
+def list_all_pdfs(service, max_results=None, fields='id, name'):
+    """List PDF files from Google Drive (all of them unless max_results is given), requesting only the given file fields"""
     try:
         query = "mimeType='application/pdf' and trashed=false"
         
-        results = service.files().list(
-            q=query,
-            pageSize=min(max_results, 1000),
-            fields="nextPageToken, files(id, name, size, modifiedTime, parents)"
-        ).execute()
-        
-        items = results.get('files', [])
+        # Page through the results at the maximum page size
+        items = []
+        page_token = None
+        while True:
+            results = retry(service.files().list(
+                q=query,
+                pageSize=1000,
+                pageToken=page_token,
+                fields=f"nextPageToken, files({fields})"
+            ).execute)
+            
+            items.extend(results.get('files', []))
+            
+            page_token = results.get('nextPageToken')
+            if not page_token or (max_results and len(items) >= max_results):
+                break
+        
+        if max_results:
+            items = items[:max_results]
+        
+        # Resolve parent folder names from the cached folder map
+        folder_map = {}
+        unique_parents = {item['parents'][0] for item in items if item.get('parents')}
+        if unique_parents:
+            folder_map = get_folder_name_map(service)
+            
+            # Folders missing from the listing (e.g. the Drive root) are resolved in batches
+            missing_parents = unique_parents - folder_map.keys()
+            if missing_parents:
+                folder_map.update(get_folder_names(service, missing_parents))
         
-        # Get parent folder names
         pdfs = []
         for item in items:
             # Get parent folder name
             parent_name = "Drive"
             if item.get('parents'):
-                try:
-                    parent_id = item['parents'][0]
-                    parent_info = service.files().get(fileId=parent_id, fields='name').execute()
-                    parent_name = parent_info.get('name', 'Drive')
-                except:
-                    parent_name = "Drive"
+                parent_name = folder_map.get(item['parents'][0], 'Drive')
             
             # Format modified time
             modified_time = item.get('modifiedTime', '')
@@ -298,6 +177,8 @@ def list_all_pdfs(service, max_results=1000):
                 'name': item['name'],
                 'size': int(item.get('size', 0)),
                 'modifiedTime': modified_time,
+                # Full RFC 3339 timestamp, precise enough to key the text cache
+                'modifiedTimeRaw': item.get('modifiedTime', ''),
                 'parent': parent_name,
                 'drive_link': f"https://drive.google.com/file/d/{item['id']}/view"
             })
@@ -308,32 +189,132 @@ def list_all_pdfs(service, max_results=1000):
         st.error(f"Error listing PDFs: {str(e)}")
         return []
 
-def download_pdf_content(service, file_id):
+class PdfTextCacheMiss(Exception):
+    """Raised to look up the PDF text cache without populating it"""
+
+def _raise_cache_miss():
+    raise PdfTextCacheMiss()
+
+@st.cache_data(max_entries=500, show_spinner=False)
+def _cached_pdf_text(file_id, modified_time, _load_text):
+    """Cache extracted PDF text per file version (_load_text is not hashed)"""
+    # modified_time must be Drive's raw modifiedTime: the minute-precision
+    # display string cannot tell apart two edits within the same minute
+    # Exceptions are never cached, so _raise_cache_miss works as a pure lookup
+    return _load_text()
+
+def _download_pdf_text(service, file_id):
+    """Download a PDF through the Drive service and extract its text"""
+    # Stream the download to a temp file instead of holding it in memory
+    request = service.files().get_media(fileId=file_id)
+    pdf_file = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+    try:
+        with pdf_file:
+            downloader = MediaIoBaseDownload(pdf_file, request, chunksize=MEDIA_CHUNK_SIZE)
+            done = False
+            while done is False:
+                status, done = retry(downloader.next_chunk)
+        
+        # Extract text from PDF (PDFium reads the file natively)
+        return extract_pdf_text(pdf_file.name)
+    finally:
+        os.unlink(pdf_file.name)
+
+def download_pdf_content(service, file_id, modified_time=None):
     """Download and extract text content from PDF"""
     try:
-        # Download file
-        request = service.files().get_media(fileId=file_id)
-        file_buffer = io.BytesIO()
+        if not modified_time:
+            return _download_pdf_text(service, file_id)
         
-        downloader = MediaIoBaseDownload(file_buffer, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        
-        file_buffer.seek(0)
-        
-        # Extract text from PDF
-        pdf_reader = PyPDF2.PdfReader(file_buffer)
-        text_content = ""
-        
-        for page in pdf_reader.pages:
-            try:
-                text_content += page.extract_text() + "\n"
-            except:
-                continue
-        
-        return text_content.strip()
+        # Reuse the text extracted for this file version on earlier runs
+        return _cached_pdf_text(file_id, modified_time, lambda: _download_pdf_text(service, file_id))
         
     except Exception as e:
         st.error(f"Error downloading PDF content: {str(e)}")
-        return ""
\ No newline at end of file
+        return ""
+
+def bulk_extract(service, file_ids, modified_times=None, max_concurrency=10, on_progress=None):
+    """Download several PDFs concurrently and extract their text in worker processes"""
+    modified_times = modified_times or {}
+    
+    # Serve file versions extracted on earlier runs from the cache
+    results = {}
+    pending_ids = []
+    for file_id in file_ids:
+        if modified_times.get(file_id):
+            try:
+                results[file_id] = _cached_pdf_text(file_id, modified_times[file_id], _raise_cache_miss)
+                continue
+            except PdfTextCacheMiss:
+                pass
+        pending_ids.append(file_id)
+    
+    # on_progress(done, total) is reported as each file finishes
+    total = len(file_ids)
+    completed = len(results)
+    if on_progress:
+        on_progress(completed, total)
+    
+    if not pending_ids:
+        return results
+    
+    credentials = service._http.credentials
+    if not credentials.valid:
+        credentials.refresh(Request())
+    headers = {'Authorization': f"Bearer {credentials.token}"}
+    
+    async def fetch(client, semaphore, file_id):
+        nonlocal completed
+        # Bound the downloads (and their temp files) that are in flight at once
+        async with semaphore:
+            pdf_file = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+            try:
+                with pdf_file:
+                    for attempt in range(RETRY_MAX_ATTEMPTS):
+                        async with client.stream('GET', f"{DRIVE_FILES_URL}/{file_id}", params={'alt': 'media'}, headers=headers) as response:
+                            # Only a 403's body tells a rate limit apart from a permission error
+                            content = await response.aread() if response.status_code == 403 else b''
+                            if _is_retryable(response.status_code, content) and attempt < RETRY_MAX_ATTEMPTS - 1:
+                                delay = _retry_delay(attempt, response.headers.get('retry-after'))
+                            else:
+                                response.raise_for_status()
+                                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                                    pdf_file.write(chunk)
+                                break
+                        await asyncio.sleep(delay)
+            
+                # Parse in the process pool while other downloads keep streaming; large
+                # PDFs are split by page range so a single big file uses every core
+                loop = asyncio.get_running_loop()
+                text_content = await loop.run_in_executor(None, extract_pdf_file, pdf_file.name)
+                return file_id, text_content
+            except Exception as e:
+                st.error(f"Error downloading PDF content: {str(e)}")
+                return file_id, None
+            finally:
+                os.unlink(pdf_file.name)
+                # Every fetch runs on the event loop thread, so the counter needs no lock
+                completed += 1
+                if on_progress:
+                    on_progress(completed, total)
+    
+    async def fetch_all():
+        # HTTP/2 multiplexes the downloads over one pooled TLS connection; the connection
+        # limit does not cap streams, the semaphore in fetch does
+        limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=10)
+        async with httpx.AsyncClient(http2=True, timeout=30, limits=limits, follow_redirects=True) as client:
+            semaphore = asyncio.Semaphore(max_concurrency)
+            return await asyncio.gather(*[fetch(client, semaphore, file_id) for file_id in pending_ids])
+    
+    fetched = asyncio.run(fetch_all())
+    
+    for file_id, text_content in fetched:
+        if text_content is None:
+            results[file_id] = ""
+            continue
+        
+        results[file_id] = text_content
+        if modified_times.get(file_id):
+            _cached_pdf_text(file_id, modified_times[file_id], lambda text=text_content: text)
+    
+    return results
@@ -0,0 +1,90 @@
+"""
+ONNX Runtime encoder for all-MiniLM-L6-v2 with int8-quantized weights
+Run `python onnx_encoder.py` once to export the model into ./onnx
+"""
+
+import os
+import numpy as np
+
+ONNX_SOURCE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_MODEL_DIR = os.getenv('IMOS_ONNX_DIR', 'onnx')
+ONNX_MODEL_FILE = 'model.int8.onnx'
+
+# all-MiniLM-L6-v2 was trained on sequences of up to 256 word pieces
+MAX_SEQ_LENGTH = 256
+
+def onnx_model_available(model_dir=ONNX_MODEL_DIR):
+    """Check whether the quantized ONNX model has been exported"""
+    return os.path.exists(os.path.join(model_dir, ONNX_MODEL_FILE))
+
+class OnnxSentenceEncoder:
+    """Drop-in replacement for SentenceTransformer.encode backed by ONNX Runtime"""
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = os.cpu_count() or 1
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL_FILE),
+            options,
+            providers=['CPUExecutionProvider']
+        )
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def _encode_batch(self, sentences):
+        """Mean-pool the token embeddings of one batch of sentences"""
+        tokens = self.tokenizer(
+            sentences,
+            padding=True,
+            truncation=True,
+            max_length=MAX_SEQ_LENGTH,
+            return_tensors='np'
+        )
+        token_embeddings = self.session.run(None, {
+            name: tokens[name].astype(np.int64) for name in self.input_names
+        })[0]
+
+        mask = tokens['attention_mask'][..., None].astype(np.float32)
+        return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False, normalize_embeddings=False):
+        """Encode a sentence or list of sentences (same call signature as SentenceTransformer)"""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        # Batch sentences of similar length together to minimize padding
+        order = np.argsort([-len(sentence) for sentence in sentences])
+        batches = [
+            self._encode_batch([sentences[i] for i in order[start:start + batch_size]])
+            for start in range(0, len(sentences), batch_size)
+        ]
+        embeddings = np.vstack(batches)[np.argsort(order)]
+
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+        return embeddings[0] if single else embeddings
+
+def export_model(model_dir=ONNX_MODEL_DIR):
+    """Export all-MiniLM-L6-v2 to ONNX and quantize its weights to int8"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
+    model = ORTModelForFeatureExtraction.from_pretrained(ONNX_SOURCE_MODEL, export=True)
+    model.save_pretrained(model_dir)
+    AutoTokenizer.from_pretrained(ONNX_SOURCE_MODEL).save_pretrained(model_dir)
+
+    quantize_dynamic(
+        os.path.join(model_dir, 'model.onnx'),
+        os.path.join(model_dir, ONNX_MODEL_FILE),
+        weight_type=QuantType.QInt8
+    )
+    print(f"Quantized model written to {os.path.join(model_dir, ONNX_MODEL_FILE)}")
+
+if __name__ == "__main__":
+    export_model()
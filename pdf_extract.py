@@ -0,0 +1,112 @@
+"""
+PDF text extraction in worker processes
+Kept free of Streamlit imports: spawned workers import this module to unpickle their tasks
+"""
+
+import multiprocessing
+import multiprocessing.context
+import os
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+import pypdfium2 as pdfium
+
+# PDFs with fewer pages are parsed inline, where process overhead would dominate
+PARALLEL_EXTRACT_MIN_PAGES = 10
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+_main_swap_lock = threading.Lock()
+
+class _WorkerProcess(multiprocessing.context.SpawnProcess):
+    """Spawned process that does not re-run the parent's __main__"""
+
+    def start(self):
+        # Spawn re-executes sys.modules['__main__'] in the child. Under Streamlit that is
+        # the app script (torch, models, st.set_page_config...), so hide it while the
+        # child's preparation data is collected, which happens inside start()
+        placeholder = types.ModuleType('__main__')
+        with _main_swap_lock:
+            main_module = sys.modules['__main__']
+            sys.modules['__main__'] = placeholder
+            try:
+                super().start()
+            finally:
+                # Leave __main__ alone if a script rerun replaced it meanwhile
+                if sys.modules['__main__'] is placeholder:
+                    sys.modules['__main__'] = main_module
+
+class _WorkerContext(multiprocessing.context.SpawnContext):
+    Process = _WorkerProcess
+
+def _get_extract_pool():
+    """Get the process pool shared by all PDF text extraction work"""
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            # Spawn rather than fork: the Streamlit server process is multi-threaded
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=_WorkerContext()
+            )
+        return _extract_pool
+
+def _extract_page_texts(pdf, start, stop):
+    """Extract the text of pages [start, stop) from an open PDF"""
+    page_texts = []
+    for index in range(start, stop):
+        try:
+            page_texts.append(pdf[index].get_textpage().get_text_range())
+        except:
+            continue
+    return page_texts
+
+def _extract_page_range(pdf_path, start, stop):
+    """Extract the text of pages [start, stop) from a PDF file (runs in a worker process)"""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return _extract_page_texts(pdf, start, stop)
+    finally:
+        pdf.close()
+
+def _extract_pdf_file(pdf_path):
+    """Extract all text from a PDF file inline (runs in a worker process)"""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return "\n".join(_extract_page_texts(pdf, 0, len(pdf))).strip()
+    finally:
+        pdf.close()
+
+def extract_pdf_text(pdf_input):
+    """Extract text content from a PDF path, bytes or file object"""
+    pdf = pdfium.PdfDocument(pdf_input)
+    try:
+        page_count = len(pdf)
+        # Small PDFs (and in-memory input) are cheaper to parse inline
+        if page_count < PARALLEL_EXTRACT_MIN_PAGES or not isinstance(pdf_input, str):
+            return "\n".join(_extract_page_texts(pdf, 0, page_count)).strip()
+    finally:
+        pdf.close()
+    
+    return _extract_page_ranges(pdf_input, page_count)
+
+def extract_pdf_file(pdf_path):
+    """Extract text from a PDF file in the worker processes, splitting large PDFs across them"""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        page_count = len(pdf)
+    finally:
+        pdf.close()
+    
+    if page_count < PARALLEL_EXTRACT_MIN_PAGES:
+        return _get_extract_pool().submit(_extract_pdf_file, pdf_path).result()
+    return _extract_page_ranges(pdf_path, page_count)
+
+def _extract_page_ranges(pdf_path, page_count):
+    """Extract a PDF file's text with one contiguous page range per worker process"""
+    workers = min(os.cpu_count() or 1, page_count)
+    bounds = [page_count * i // workers for i in range(workers + 1)]
+    parts = _get_extract_pool().map(_extract_page_range, [pdf_path] * workers, bounds[:-1], bounds[1:])
+    
+    return "\n".join(text for part in parts for text in part).strip()
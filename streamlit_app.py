@@ -1,11 +1,15 @@
 import streamlit as st
 import sqlite3
 import json
+import hashlib
 import os
+import threading
 from datetime import datetime
 import numpy as np
+import pandas as pd
+import torch
 from sentence_transformers import SentenceTransformer
-import requests
+import httpx
 from dotenv import load_dotenv
 import uuid
 from auth_improved import (
@@ -14,10 +18,33 @@ from auth_improved import (
     init_drive_service,
     sign_out
 )
+from onnx_encoder import OnnxSentenceEncoder, onnx_model_available
 from gdrive_auth_streamlit import (
     list_all_pdfs, 
-    download_pdf_content
+    bulk_extract
 )
+try:
+    import sqlite_vec
+except ImportError:
+    sqlite_vec = None
+try:
+    from chunk_index import ChunkIndex
+except ImportError:
+    ChunkIndex = None
+
+# Chunk count above which searches go through the HNSW index (when usearch is installed);
+# below it the exact scan of the cached matrix takes milliseconds
+ANN_MIN_CHUNKS = 500000
+
+# Minimum cosine similarity for a document to be returned by search
+SIMILARITY_THRESHOLD = 0.1
+
+# Chunks retrieved from the HNSW index per requested document
+ANN_OVERSAMPLE = 10
+
+# Sliding window used to split documents into chunks (MiniLM reads at most 256 tokens)
+CHUNK_WORDS = 200
+CHUNK_OVERLAP_WORDS = 40
 
 # Load environment variables
 load_dotenv()
@@ -63,9 +90,6 @@ if 'authenticated' not in st.session_state:
 if 'drive_service' not in st.session_state:
     st.session_state.drive_service = None
 
-if 'embed_model' not in st.session_state:
-    st.session_state.embed_model = None
-
 if 'current_page' not in st.session_state:
     st.session_state.current_page = 'landing'
 
@@ -78,10 +102,15 @@ if 'conversation_history' not in st.session_state:
 if 'import_complete' not in st.session_state:
     st.session_state.import_complete = False
 
+def is_signed_in():
+    """Authentication state, re-checked until sign-in and then kept for the session"""
+    if not st.session_state.get('authenticated'):
+        st.session_state.authenticated = is_authenticated()
+    return st.session_state.authenticated
+
 # Initialize database
-def setup_db():
+def setup_db(conn):
     """Initialize SQLite database"""
-    conn = sqlite3.connect('memoryos.db')
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS pdf_documents (
@@ -98,103 +127,449 @@ def setup_db():
             last_indexed TIMESTAMP
         )
     ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_user ON pdf_documents(user_id)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS pdf_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_id TEXT NOT NULL,
+            chunk_idx INTEGER NOT NULL,
+            text TEXT,
+            embedding BLOB,
+            UNIQUE (file_id, chunk_idx)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            content_sha BLOB PRIMARY KEY,
+            embedding BLOB
+        )
+    ''')
+
+    # Convert float32 blobs from before int8 quantization (schema version 0)
+    if c.execute('PRAGMA user_version').fetchone()[0] < 1:
+        c.execute("SELECT id, embedding FROM pdf_documents WHERE typeof(embedding) = 'blob'")
+        c.executemany('UPDATE pdf_documents SET embedding = ? WHERE id = ?', [
+            (quantize_embedding(normalize_embedding(np.frombuffer(embedding, dtype=np.float32))).tobytes(), row_id)
+            for row_id, embedding in c.fetchall()
+        ])
+        c.execute('PRAGMA user_version = 1')
+
+    # Embedding cache keys before version 2 did not include the model
+    if c.execute('PRAGMA user_version').fetchone()[0] < 2:
+        c.execute('DELETE FROM embedding_cache')
+        c.execute('PRAGMA user_version = 2')
+
+    # Convert embeddings stored as JSON text by older versions to int8 blobs
+    c.execute("SELECT id, embedding FROM pdf_documents WHERE typeof(embedding) = 'text'")
+    legacy_rows = c.fetchall()
+    if legacy_rows:
+        c.executemany('UPDATE pdf_documents SET embedding = ? WHERE id = ?', [
+            (quantize_embedding(normalize_embedding(np.asarray(json.loads(embedding), dtype=np.float32))).tobytes(), row_id)
+            for row_id, embedding in legacy_rows
+        ])
+
+    # Documents indexed before chunking get one chunk from their document embedding
+    c.execute('''
+        INSERT INTO pdf_chunks (file_id, chunk_idx, text, embedding)
+        SELECT file_id, 0, substr(text_content, 1, 4000), embedding
+        FROM pdf_documents d
+        WHERE embedding IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM pdf_chunks c WHERE c.file_id = d.file_id)
+    ''')
+
     conn.commit()
-    conn.close()
 
-def get_embed_model():
-    """Lazy loading of the embedding model with error handling"""
-    if st.session_state.embed_model is None:
+@st.cache_resource(show_spinner="Loading AI model...")
+def load_embed_model():
+    """Load the embedding model once per process, returning (model_id, model)"""
+    # Prefer the int8 ONNX export of all-MiniLM-L6-v2 when it has been built
+    if onnx_model_available():
         try:
-            with st.spinner("Loading AI model..."):
-                st.session_state.embed_model = SentenceTransformer("all-MiniLM-L6-v2")
+            return "onnx-int8/all-MiniLM-L6-v2", OnnxSentenceEncoder()
         except Exception as e:
-            st.error(f"Error loading embedding model: {e}")
-            # Try a smaller model as fallback
-            try:
-                st.session_state.embed_model = SentenceTransformer("paraphrase-MiniLM-L3-v2")
-            except Exception as e2:
-                st.error(f"Failed to load fallback model: {e2}")
-                raise
-    return st.session_state.embed_model
+            print(f"Warning: Could not load ONNX encoder: {e}")
+    
+    # Encode on every core
+    torch.set_num_threads(max(1, os.cpu_count() or 1))
+    try:
+        return "all-MiniLM-L6-v2", SentenceTransformer("all-MiniLM-L6-v2")
+    except Exception as e:
+        st.error(f"Error loading embedding model: {e}")
+        # Try a smaller model as fallback
+        try:
+            return "paraphrase-MiniLM-L3-v2", SentenceTransformer("paraphrase-MiniLM-L3-v2")
+        except Exception as e2:
+            st.error(f"Failed to load fallback model: {e2}")
+            raise
+
+def get_embed_model():
+    """Get the embedding model with error handling"""
+    return load_embed_model()[1]
 
-def compute_embedding(text):
-    """Compute text embedding"""
-    if len(text) > 4000:
-        text = text[:4000]
+def get_embed_model_id():
+    """Identify the loaded embedding model, for keying cached embeddings"""
+    return load_embed_model()[0]
+
+def normalize_embedding(emb):
+    """Scale an embedding to unit length"""
+    return emb / np.linalg.norm(emb, axis=-1, keepdims=True)
+
+def quantize_embedding(emb):
+    """Quantize a unit-length embedding to int8 with a fixed scale of 127"""
+    return np.clip(np.round(emb * 127), -127, 127).astype(np.int8)
+
+def split_into_chunks(text, chunk_words=CHUNK_WORDS, overlap_words=CHUNK_OVERLAP_WORDS):
+    """Split text into overlapping windows of words"""
+    words = text.split()
+    step = chunk_words - overlap_words
+    return [
+        ' '.join(words[start:start + chunk_words])
+        for start in range(0, max(len(words) - overlap_words, 1), step)
+    ]
+
+def compute_embeddings(texts):
+    """Compute text embeddings for a list of texts in batches"""
     model = get_embed_model()
-    emb = model.encode(text, convert_to_numpy=True).tolist()
-    return json.dumps(emb)
+    embs = model.encode(
+        texts,
+        batch_size=64,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+        normalize_embeddings=True
+    )
+    return [emb.tobytes() for emb in quantize_embedding(embs)]
+
+def compute_embeddings_cached(texts):
+    """Compute text embeddings, reusing those stored for identical text and model"""
+    conn = get_conn()
+    # The models are all 384-dimensional but embed into different spaces,
+    # so the key covers the model as well as the text
+    model_key = get_embed_model_id().encode() + b'\0'
+    shas = [hashlib.sha256(model_key + text.encode()).digest() for text in texts]
+    
+    # Look up known content in batches that stay under SQLite's variable limit
+    embeddings = {}
+    unique_shas = list(set(shas))
+    for start in range(0, len(unique_shas), 500):
+        batch = unique_shas[start:start + 500]
+        placeholders = ', '.join('?' * len(batch))
+        embeddings.update(conn.execute(
+            f'SELECT content_sha, embedding FROM embedding_cache WHERE content_sha IN ({placeholders})',
+            batch
+        ).fetchall())
+    
+    # Embed each missing text once and remember it
+    missing = {}
+    for sha, text in zip(shas, texts):
+        if sha not in embeddings:
+            missing.setdefault(sha, text)
+    if missing:
+        new_embeddings = dict(zip(missing, compute_embeddings(list(missing.values()))))
+        with get_write_lock(), conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO embedding_cache (content_sha, embedding) VALUES (?, ?)',
+                new_embeddings.items()
+            )
+        embeddings.update(new_embeddings)
+    
+    return [embeddings[sha] for sha in shas]
+
+def connect_db(**kwargs):
+    """Open a SQLite connection in WAL mode, with sqlite-vec loaded when available"""
+    conn = sqlite3.connect('memoryos.db', **kwargs)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    
+    # Load sqlite-vec for in-database vector distances (the search fallback) when available
+    if sqlite_vec is not None:
+        try:
+            conn.enable_load_extension(True)
+            sqlite_vec.load(conn)
+            conn.enable_load_extension(False)
+        except (AttributeError, sqlite3.Error) as e:
+            print(f"Warning: Could not load sqlite-vec: {e}")
+    return conn
+
+@st.cache_resource
+def get_conn():
+    """Shared SQLite connection for writes, initialized once per process"""
+    conn = connect_db(check_same_thread=False)
+    setup_db(conn)
+    return conn
+
+@st.cache_resource
+def get_read_conns():
+    """Per-thread holder of read connections"""
+    return threading.local()
+
+def get_read_conn():
+    """Read connection for the current thread, which sees committed data only"""
+    # Reading through the shared connection would expose another session's half-done
+    # import; committed reads keep a matrix loaded after its signature no older than it
+    conns = get_read_conns()
+    if getattr(conns, 'conn', None) is None:
+        get_conn()  # Make sure the schema exists
+        conns.conn = connect_db()
+    return conns.conn
+
+@st.cache_resource
+def get_write_lock():
+    """Lock serializing write transactions on the shared connection"""
+    # Sessions share one connection, so their transactions must not interleave:
+    # one session's commit or rollback would end another's transaction
+    return threading.Lock()
 
-def cosine_sim(a, b):
-    """Compute cosine similarity"""
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+def has_sqlite_vec():
+    """Whether the read connections have the sqlite-vec functions"""
+    try:
+        get_read_conn().execute('SELECT vec_version()')
+        return True
+    except sqlite3.Error:
+        return False
+
+def save_pdfs_to_db(rows, chunk_rows):
+    """Save PDF rows and their chunks to the database in a single transaction"""
+    conn = get_conn()
+    indexed_at = datetime.utcnow()
+    with get_write_lock(), conn:
+        replaced_ids = [
+            chunk_id
+            for row in rows
+            for (chunk_id,) in conn.execute('SELECT id FROM pdf_chunks WHERE file_id = ?', (row[1],))
+        ]
+        max_chunk_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM pdf_chunks').fetchone()[0]
+        
+        conn.executemany('''
+            INSERT OR REPLACE INTO pdf_documents
+            (user_id, file_id, name, drive_link, modified_time, size, parent, text_content, last_indexed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [row + (indexed_at,) for row in rows])
+        
+        # Replace the chunks of re-imported documents
+        conn.executemany('DELETE FROM pdf_chunks WHERE file_id = ?', [(row[1],) for row in rows])
+        conn.executemany('''
+            INSERT INTO pdf_chunks (file_id, chunk_idx, text, embedding)
+            VALUES (?, ?, ?, ?)
+        ''', chunk_rows)
+        # AUTOINCREMENT ids only grow, so the new chunks are the ones past the old maximum
+        added_rows = conn.execute('SELECT id, embedding FROM pdf_chunks WHERE id > ?', (max_chunk_id,)).fetchall()
+    
+    # Update the persisted HNSW index in place rather than rebuilding it
+    if ChunkIndex is not None:
+        for ndim in {len(embedding) for _, embedding in added_rows if embedding}:
+            get_chunk_index(ndim).update(replaced_ids, added_rows)
 
-def save_pdf_to_db(user_id, file_id, name, drive_link, modified_time, size, parent, text_content, embedding=None):
-    """Save PDF data to database"""
-    conn = sqlite3.connect('memoryos.db')
+@st.cache_data(max_entries=512, show_spinner=False)
+def encode_query(text):
+    """Encode a search query to int8-quantized bytes"""
+    # st.cache_data rather than lru_cache: this script is re-executed on every rerun
+    emb = get_embed_model().encode(text, convert_to_numpy=True, normalize_embeddings=True)
+    return quantize_embedding(emb).tobytes()
+
+def get_embedding_signature(user_id=None):
+    """Row count and latest index time, which change whenever embeddings do"""
+    conn = get_read_conn()
     c = conn.cursor()
-    c.execute('''
-        INSERT OR REPLACE INTO pdf_documents
-        (user_id, file_id, name, drive_link, modified_time, size, parent, text_content, embedding, last_indexed)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        user_id, file_id, name, drive_link, modified_time, size, parent, 
-        text_content, embedding, datetime.utcnow()
+    if user_id:
+        c.execute('SELECT COUNT(*), MAX(last_indexed) FROM pdf_documents WHERE user_id = ?', (user_id,))
+    else:
+        c.execute('SELECT COUNT(*), MAX(last_indexed) FROM pdf_documents')
+    signature = c.fetchone()
+    return signature
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def load_embedding_matrix(user_id, signature, nbytes):
+    """Load the chunk embedding matrix as float32 (signature only keys the cache)"""
+    # Returns ascending chunk ids, the distinct document ids, each chunk's
+    # position in doc_ids, and the matrix
+    conn = get_read_conn()
+    c = conn.cursor()
+
+    # Skip embeddings from a different model (dimension mismatch)
+    user_filter = 'AND d.user_id = ?' if user_id else ''
+    c.execute(f'''
+        SELECT c.id, d.id, c.embedding
+        FROM pdf_chunks c JOIN pdf_documents d ON d.file_id = c.file_id
+        WHERE length(c.embedding) = ? {user_filter}
+        ORDER BY c.id
+    ''', [nbytes] + ([user_id] if user_id else []))
+    rows = c.fetchall()
+    if not rows:
+        empty_ids = np.empty(0, dtype=np.int64)
+        return empty_ids, empty_ids, empty_ids, np.empty((0, nbytes), dtype=np.float32)
+
+    chunk_ids = np.array([row[0] for row in rows])
+    doc_ids, doc_index = np.unique([row[1] for row in rows], return_inverse=True)
+
+    # Stored as int8, but scored in float32: NumPy has BLAS kernels only for floats
+    emb_matrix = np.frombuffer(b''.join(row[2] for row in rows), dtype=np.int8).reshape(len(rows), nbytes)
+    emb_matrix = emb_matrix.astype(np.float32)
+    emb_matrix /= 127
+    return chunk_ids, doc_ids, doc_index, emb_matrix
+
+def top_documents(scores, chunk_ids, doc_ids, doc_index, top_k):
+    """Reduce chunk scores to the top_k documents, returning {doc_id: (score, chunk_id)}"""
+    # Drop chunks under the similarity threshold with one vectorized mask
+    keep = np.flatnonzero(scores > SIMILARITY_THRESHOLD)
+    scores, chunk_ids, doc_index = scores[keep], chunk_ids[keep], doc_index[keep]
+
+    # A document scores as its best matching chunk
+    doc_scores = np.full(len(doc_ids), -np.inf)
+    np.maximum.at(doc_scores, doc_index, scores)
+    candidates = np.flatnonzero(np.isfinite(doc_scores))
+    if not len(candidates):
+        return {}
+
+    # Select the top_k scores without sorting all of them, mapped back through candidates
+    k = min(top_k, len(candidates))
+    top_idx = candidates[np.argpartition(-doc_scores[candidates], k - 1)[:k]]
+    top_idx = top_idx[np.argsort(-doc_scores[top_idx])]
+
+    results = {}
+    for i in top_idx:
+        doc_chunks = np.flatnonzero(doc_index == i)
+        best_chunk = doc_chunks[np.argmax(scores[doc_chunks])]
+        results[int(doc_ids[i])] = (float(doc_scores[i]), int(chunk_ids[best_chunk]))
+    return results
+
+def search_embedding_matrix(query_emb, top_k, user_id, signature):
+    """Score chunks in NumPy, returning {doc_id: (score, chunk_id)} for the top_k documents"""
+    # The matrix is rebuilt only after documents are added or re-indexed
+    chunk_ids, doc_ids, doc_index, emb_matrix = load_embedding_matrix(user_id, signature, query_emb.nbytes)
+    if not len(chunk_ids):
+        return {}
+
+    # Score all chunks with one float32 matrix-vector product over unit vectors
+    scores = emb_matrix @ (query_emb.astype(np.float32) / 127)
+    return top_documents(scores, chunk_ids, doc_ids, doc_index, top_k)
+
+@st.cache_resource
+def get_chunk_index(ndim):
+    """HNSW index over the chunk embeddings, persisted beside the database"""
+    return ChunkIndex('memoryos.db', ndim)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def count_chunks(user_id, signature):
+    """Number of chunks searched for the user (signature only keys the cache)"""
+    user_filter = 'WHERE d.user_id = ?' if user_id else ''
+    return get_read_conn().execute(f'''
+        SELECT COUNT(*)
+        FROM pdf_chunks c JOIN pdf_documents d ON d.file_id = c.file_id
+        {user_filter}
+    ''', [user_id] if user_id else []).fetchone()[0]
+
+def search_ann_index(chunk_index, query_emb, top_k, user_id):
+    """Approximate search through the HNSW index, returning {doc_id: (score, chunk_id)}"""
+    # Fetch extra chunks since several may belong to the same document (or another user)
+    matches = chunk_index.search(query_emb.astype(np.float32) / 127, top_k * ANN_OVERSAMPLE)
+    match_scores = dict(zip(
+        np.asarray(matches.keys, dtype=np.int64).tolist(),
+        (1.0 - np.asarray(matches.distances, dtype=np.float64)).tolist()
     ))
-    conn.commit()
-    conn.close()
+    if not match_scores:
+        return {}
+
+    # Map the matched chunks to their documents, dropping other users' chunks
+    user_filter = 'AND d.user_id = ?' if user_id else ''
+    placeholders = ', '.join('?' * len(match_scores))
+    rows = get_read_conn().execute(f'''
+        SELECT c.id, d.id
+        FROM pdf_chunks c JOIN pdf_documents d ON d.file_id = c.file_id
+        WHERE c.id IN ({placeholders}) {user_filter}
+    ''', list(match_scores) + ([user_id] if user_id else [])).fetchall()
+    if not rows:
+        return {}
+
+    chunk_ids = np.array([row[0] for row in rows])
+    doc_ids, doc_index = np.unique([row[1] for row in rows], return_inverse=True)
+    scores = np.array([match_scores[row[0]] for row in rows])
+    return top_documents(scores, chunk_ids, doc_ids, doc_index, top_k)
+
+def search_sqlite_vec(query_emb, top_k, user_id=None):
+    """Score chunks inside SQLite with sqlite-vec, returning {doc_id: (score, chunk_id)} for the top_k documents"""
+    user_filter = 'AND d.user_id = ?' if user_id else ''
+    params = [query_emb.tobytes(), query_emb.nbytes] + ([user_id] if user_id else []) + [top_k]
+    # SQLite takes the bare c.id column from the row holding the MIN()
+    rows = get_read_conn().execute(f'''
+        SELECT d.id, c.id, MIN(vec_distance_l2(vec_int8(c.embedding), vec_int8(?))) AS distance
+        FROM pdf_chunks c JOIN pdf_documents d ON d.file_id = c.file_id
+        WHERE length(c.embedding) = ? {user_filter}
+        GROUP BY d.id
+        ORDER BY distance
+        LIMIT ?
+    ''', params).fetchall()
+    # Embeddings are unit vectors times 127, so |a - b|^2 = 2 * 127^2 * (1 - cos)
+    return {doc_id: (1.0 - distance ** 2 / (2 * 127 ** 2), chunk_id) for doc_id, chunk_id, distance in rows}
 
 def semantic_search(query, top_k=5, user_id=None):
     """Perform semantic search on documents"""
     if not query:
         return []
-    
-    # Compute query embedding
-    model = get_embed_model()
-    query_emb = model.encode(query, convert_to_numpy=True)
-    
-    conn = sqlite3.connect('memoryos.db')
+
+    # Compute query embedding (repeat queries are served from the cache)
+    query_emb = np.frombuffer(encode_query(query), dtype=np.int8)
+
+    # Large corpora use the approximate index, smaller ones an exact scan
+    signature = get_embedding_signature(user_id)
+    top_scores = None
+    if ChunkIndex is not None and count_chunks(user_id, signature) >= ANN_MIN_CHUNKS:
+        # The index loads (or builds) off the request thread; scan exactly until it is ready
+        chunk_index = get_chunk_index(query_emb.nbytes)
+        chunk_index.ensure_loaded()
+        if chunk_index.ready:
+            top_scores = search_ann_index(chunk_index, query_emb, top_k, user_id)
+    if top_scores is None:
+        try:
+            top_scores = search_embedding_matrix(query_emb, top_k, user_id, signature)
+        except MemoryError:
+            # sqlite-vec scans the chunks inside SQLite without holding them all in memory
+            if not has_sqlite_vec():
+                raise
+            top_scores = search_sqlite_vec(query_emb, top_k, user_id)
+
+    # Keep matches above the similarity threshold
+    top_scores = {doc_id: match for doc_id, match in top_scores.items() if match[0] > SIMILARITY_THRESHOLD}
+    if not top_scores:
+        return []
+
+    # Fetch metadata and the best matching chunk only for the top matches
+    conn = get_read_conn()
     c = conn.cursor()
-    
-    if user_id:
-        c.execute('''
-            SELECT file_id, name, drive_link, modified_time, size, parent, text_content, embedding 
-            FROM pdf_documents 
-            WHERE user_id = ? AND embedding IS NOT NULL
-        ''', (user_id,))
-    else:
-        c.execute('''
-            SELECT file_id, name, drive_link, modified_time, size, parent, text_content, embedding 
-            FROM pdf_documents
-            WHERE embedding IS NOT NULL
-        ''')
+    placeholders = ', '.join('?' * len(top_scores))
+    c.execute(f'''
+        SELECT id, file_id, name, drive_link, modified_time, size, parent
+        FROM pdf_documents
+        WHERE id IN ({placeholders})
+    ''', list(top_scores))
+    metadata = {row[0]: row for row in c.fetchall()}
+    c.execute(f'''
+        SELECT id, text FROM pdf_chunks WHERE id IN ({placeholders})
+    ''', [chunk_id for _, chunk_id in top_scores.values()])
+    chunk_texts = dict(c.fetchall())
     
     results = []
-    for row in c.fetchall():
-        try:
-            if row[7]:  # Check if embedding exists
-                pdf_emb = np.array(json.loads(row[7]))
-                score = cosine_sim(query_emb, pdf_emb)
-                if score > 0.1:  # threshold
-                    results.append({
-                        'file_id': row[0],
-                        'name': row[1],
-                        'drive_link': row[2],
-                        'modified_time': row[3],
-                        'size': row[4],
-                        'parent': row[5],
-                        'snippet': row[6][:400] if row[6] else '',
-                        'score': float(score)
-                    })
-        except Exception as e:
-            continue
+    for doc_id, (score, chunk_id) in top_scores.items():
+        row = metadata[doc_id]
+        results.append({
+            'file_id': row[1],
+            'name': row[2],
+            'drive_link': row[3],
+            'modified_time': row[4],
+            'size': row[5],
+            'parent': row[6],
+            'snippet': chunk_texts.get(chunk_id) or '',
+            'score': score
+        })
     
-    conn.close()
-    results = sorted(results, key=lambda x: x['score'], reverse=True)[:top_k]
     return results
 
+@st.cache_resource
+def get_http_client():
+    """Shared HTTP/2 client for Groq API calls"""
+    return httpx.Client(http2=True, timeout=httpx.Timeout(60, connect=10))
+
 def answer_query_with_groq(conversation_history, top_matches, groq_api_key):
-    """Generate answer using Groq API"""
+    """Stream an answer from the Groq API, yielding text as it arrives"""
     # Build context from top docs
     context = "\n---\n".join([f"{doc['name']}:\n{doc['snippet']}" for doc in top_matches])
     
@@ -240,17 +615,22 @@ def answer_query_with_groq(conversation_history, top_matches, groq_api_key):
         "messages": messages,
         "model": "llama-3.1-8b-instant",
         "max_tokens": 1500,
-        "temperature": 0.7
+        "temperature": 0.7,
+        "stream": True
     }
     
-    try:
-        response = requests.post(groq_api_url, headers=headers, json=payload)
+    # Parse the server-sent events into content deltas
+    with get_http_client().stream("POST", groq_api_url, headers=headers, json=payload) as response:
         response.raise_for_status()
-        answer = response.json()['choices'][0]['message']['content'].strip()
-        return answer, top_matches
-    except Exception as e:
-        st.error(f"Error calling Groq API: {str(e)}")
-        return "Sorry, I encountered an error while processing your request.", []
+        for line in response.iter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+            delta = json.loads(data)['choices'][0]['delta'].get('content')
+            if delta:
+                yield delta
 
 # Page functions
 def landing_page():
@@ -274,7 +654,7 @@ def import_page():
     """PDF import page"""
     st.title("📁 Import PDFs from Google Drive")
     
-    if not is_authenticated():
+    if not is_signed_in():
         st.error("Please authenticate with Google Drive first.")
         if st.button("🔙 Go to Landing"):
             st.session_state.current_page = 'landing'
@@ -286,11 +666,10 @@ def import_page():
         st.success("✅ Import completed successfully!")
         
         # Verify documents count
-        conn = sqlite3.connect('memoryos.db')
+        conn = get_read_conn()
         c = conn.cursor()
         c.execute('SELECT COUNT(*) FROM pdf_documents WHERE user_id = ?', (st.session_state.user_id,))
         saved_count = c.fetchone()[0]
-        conn.close()
         
         st.info(f"📊 Documents now in database: {saved_count}")
         st.success("🎉 Ready to chat with your documents!")
@@ -316,6 +695,7 @@ def import_page():
     with col2:
         if st.button("🔄 Refresh from Drive"):
             st.session_state.drive_pdfs_cache = None
+            st.session_state.folder_name_map = None
     
     # Load PDFs from cache or fetch new
     if st.session_state.drive_pdfs_cache is None:
@@ -323,7 +703,7 @@ def import_page():
             try:
                 drive_service = init_drive_service()
                 if drive_service:
-                    pdfs = list_all_pdfs(drive_service)
+                    pdfs = list_all_pdfs(drive_service, fields='id, name, size, modifiedTime, parents')
                     st.session_state.drive_pdfs_cache = pdfs
                 else:
                     st.error("Failed to initialize Google Drive service")
@@ -360,27 +740,30 @@ def import_page():
     # Selection interface
     st.write(f"Showing {len(filtered_pdfs)} PDFs")
     
-    selected_pdfs = []
-    for pdf in filtered_pdfs[:50]:  # Limit to first 50 for performance
-        col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
-        
-        with col1:
-            selected = st.checkbox(
-                pdf['name'], 
-                key=f"pdf_{pdf['id']}"
-            )
-            if selected:
-                selected_pdfs.append(pdf)
-        
-        with col2:
-            st.write(f"📁 {pdf.get('parent', 'Drive')}")
-        
-        with col3:
-            size_mb = pdf.get('size', 0) / 1024 / 1024
-            st.write(f"📄 {size_mb:.1f} MB")
-        
-        with col4:
-            st.markdown(f"[Open]({pdf.get('drive_link', '#')})")
+    # One table widget for all rows instead of a row of widgets per PDF
+    pdf_table = pd.DataFrame({
+        'select': False,
+        'name': [pdf['name'] for pdf in filtered_pdfs],
+        'parent': [pdf.get('parent', 'Drive') for pdf in filtered_pdfs],
+        'size_mb': [pdf.get('size', 0) / 1024 / 1024 for pdf in filtered_pdfs],
+        'drive_link': [pdf.get('drive_link', '#') for pdf in filtered_pdfs]
+    })
+    edited_table = st.data_editor(
+        pdf_table,
+        column_config={
+            'select': st.column_config.CheckboxColumn("Import", default=False),
+            'name': st.column_config.TextColumn("Name"),
+            'parent': st.column_config.TextColumn("📁 Folder"),
+            'size_mb': st.column_config.NumberColumn("📄 Size (MB)", format="%.1f"),
+            'drive_link': st.column_config.LinkColumn("Open", display_text="Open")
+        },
+        disabled=['name', 'parent', 'size_mb', 'drive_link'],
+        hide_index=True,
+        num_rows='fixed',
+        use_container_width=True,
+        key=f"pdf_selection_{search_term}"
+    )
+    selected_pdfs = [pdf for pdf, selected in zip(filtered_pdfs, edited_table['select']) if selected]
     
     # Import selected PDFs
     if selected_pdfs:
@@ -400,32 +783,56 @@ def import_pdfs(selected_pdfs):
     # Debug: Show user_id being used for import
     st.info(f"Importing {total_pdfs} PDFs for user: {st.session_state.user_id}")
     
+    # Download and extract all selected PDFs concurrently
+    drive_service = init_drive_service()
+    if not drive_service:
+        st.error("Failed to initialize Google Drive service")
+        return
+    
+    def on_download_progress(done, total):
+        status_text.text(f"Downloaded {done}/{total} PDFs...")
+        progress_bar.progress(done / total)
+    
+    pdf_texts = bulk_extract(
+        drive_service,
+        [pdf['id'] for pdf in selected_pdfs],
+        modified_times={pdf['id']: pdf.get('modifiedTimeRaw') for pdf in selected_pdfs},
+        on_progress=on_download_progress
+    )
+    
+    # Split every extracted PDF into chunks and embed them in one batched model call
+    chunks = [
+        (pdf['id'], chunk_idx, chunk)
+        for pdf in selected_pdfs if pdf_texts.get(pdf['id'])
+        for chunk_idx, chunk in enumerate(split_into_chunks(pdf_texts[pdf['id']]))
+    ]
+    status_text.text(f"Computing embeddings for {len(chunks)} chunks...")
+    try:
+        embeddings = compute_embeddings_cached([chunk[2] for chunk in chunks])
+        chunk_rows = [chunk + (embedding,) for chunk, embedding in zip(chunks, embeddings)]
+    except Exception as e:
+        st.error(f"Error computing embeddings: {str(e)}")
+        return
+    
+    rows = []
     for i, pdf in enumerate(selected_pdfs):
         try:
             status_text.text(f"Processing {pdf['name']} ({i+1}/{total_pdfs})")
             
-            # Download PDF content
-            drive_service = init_drive_service()
-            text_content = download_pdf_content(drive_service, pdf['id'])
+            text_content = pdf_texts.get(pdf['id'], '')
             
             if text_content:
-                # Compute embedding
-                embedding = compute_embedding(text_content)
-                
-                # Save to database
                 drive_link = f"https://drive.google.com/file/d/{pdf['id']}/view"
-                save_pdf_to_db(
-                    user_id=st.session_state.user_id,
-                    file_id=pdf['id'],
-                    name=pdf['name'],
-                    drive_link=drive_link,
-                    modified_time=pdf.get('modifiedTime', ''),
-                    size=pdf.get('size', 0),
-                    parent=pdf.get('parent', ''),
-                    text_content=text_content,
-                    embedding=embedding
-                )
-                successful_imports += 1
+                rows.append((
+                    st.session_state.user_id,
+                    pdf['id'],
+                    pdf['name'],
+                    drive_link,
+                    pdf.get('modifiedTime', ''),
+                    pdf.get('size', 0),
+                    pdf.get('parent', ''),
+                    text_content
+                ))
                 st.success(f"✅ Imported: {pdf['name']}")
             else:
                 st.warning(f"⚠️ No text content extracted from: {pdf['name']}")
@@ -436,6 +843,13 @@ def import_pdfs(selected_pdfs):
             st.error(f"Error processing {pdf['name']}: {str(e)}")
             continue
     
+    # Save all imported PDFs in one transaction
+    try:
+        save_pdfs_to_db(rows, chunk_rows)
+        successful_imports = len(rows)
+    except Exception as e:
+        st.error(f"Error saving PDFs to database: {str(e)}")
+    
     status_text.text("✅ Import completed!")
     st.success(f"Successfully imported {successful_imports} out of {total_pdfs} PDFs")
     
@@ -458,7 +872,7 @@ def chat_page():
     st.sidebar.info(f"User ID: {st.session_state.user_id}")
     
     # Check if user has imported documents
-    conn = sqlite3.connect('memoryos.db')
+    conn = get_read_conn()
     c = conn.cursor()
     c.execute('SELECT COUNT(*) FROM pdf_documents WHERE user_id = ?', (st.session_state.user_id,))
     doc_count = c.fetchone()[0]
@@ -471,7 +885,6 @@ def chat_page():
     c.execute('SELECT name FROM pdf_documents WHERE user_id = ? LIMIT 5', (st.session_state.user_id,))
     user_docs = c.fetchall()
     
-    conn.close()
     
     # Debug information
     st.sidebar.write(f"Total documents in DB: {total_docs}")
@@ -545,29 +958,42 @@ def chat_page():
             with st.spinner("Thinking..."):
                 # Perform semantic search
                 top_matches = semantic_search(user_query, top_k=5, user_id=st.session_state.user_id)
-                
-                # Generate answer
-                answer, sources = answer_query_with_groq(
+            
+            # Display the answer as it streams in, keeping the text that was shown
+            answer_parts = []
+            def stream_answer():
+                for delta in answer_query_with_groq(
                     st.session_state.conversation_history, 
                     top_matches, 
                     groq_api_key
-                )
-                
-                # Display answer
+                ):
+                    answer_parts.append(delta)
+                    yield delta
+            
+            try:
+                st.write_stream(stream_answer())
+            except Exception as e:
+                st.error(f"Error calling Groq API: {str(e)}")
+            
+            # History records what was displayed, including an answer cut off by an error
+            answer = ''.join(answer_parts).strip()
+            sources = top_matches if answer else []
+            if not answer:
+                answer = "Sorry, I encountered an error while processing your request."
                 st.write(answer)
-                
-                # Display sources
-                if sources:
-                    with st.expander("📚 Sources"):
-                        for source in sources:
-                            st.markdown(f"- [{source['name']}]({source['drive_link']}) (Score: {source['score']:.3f})")
-                
-                # Add assistant message to conversation
-                st.session_state.conversation_history.append({
-                    'role': 'assistant',
-                    'content': answer,
-                    'sources': sources
-                })
+            
+            # Display sources
+            if sources:
+                with st.expander("📚 Sources"):
+                    for source in sources:
+                        st.markdown(f"- [{source['name']}]({source['drive_link']}) (Score: {source['score']:.3f})")
+            
+            # Add assistant message to conversation
+            st.session_state.conversation_history.append({
+                'role': 'assistant',
+                'content': answer,
+                'sources': sources
+            })
     
     # Clear conversation button
     if st.session_state.conversation_history:
@@ -578,6 +1004,7 @@ def chat_page():
 # Sidebar navigation
 def sidebar():
     """Sidebar navigation"""
+    authenticated = is_signed_in()
     with st.sidebar:
         st.title("🧠 IMOS")
         st.markdown("---")
@@ -585,7 +1012,7 @@ def sidebar():
         # Debug information
         st.write(f"**Current page:** {st.session_state.current_page}")
         st.write(f"**User ID:** {st.session_state.user_id}")
-        st.write(f"**Authenticated:** {is_authenticated()}")
+        st.write(f"**Authenticated:** {authenticated}")
         
         st.markdown("---")
         
@@ -594,7 +1021,7 @@ def sidebar():
             st.session_state.current_page = 'landing'
             st.rerun()
         
-        if is_authenticated():
+        if authenticated:
             if st.button("📁 Import PDFs", use_container_width=True):
                 st.session_state.current_page = 'import'
                 st.rerun()
@@ -606,11 +1033,10 @@ def sidebar():
             st.markdown("---")
             
             # User info
-            conn = sqlite3.connect('memoryos.db')
+            conn = get_read_conn()
             c = conn.cursor()
             c.execute('SELECT COUNT(*) FROM pdf_documents WHERE user_id = ?', (st.session_state.user_id,))
             doc_count = c.fetchone()[0]
-            conn.close()
             
             st.metric("Documents", doc_count)
             st.metric("Conversations", len(st.session_state.conversation_history))
@@ -630,8 +1056,8 @@ def sidebar():
 def main():
     """Main application"""
     try:
-        # Initialize database
-        setup_db()
+        # Initialize database (runs once per process)
+        get_conn()
         
         # Debug: Show current page in main area
         st.caption(f"Debug: Current page = {st.session_state.current_page}")